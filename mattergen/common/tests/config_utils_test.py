@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+from mattergen.common.utils.config_utils import get_config
+from mattergen.diffusion.config import Config
+
+
+def _write_yaml(path: Path, content: str, mtime: float | None = None) -> None:
+    path.write_text(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_get_config_returns_cached_config(tmp_path: Path):
+    _write_yaml(tmp_path / "config.yaml", "params:\n  a: 1\n")
+    argv = ["--config", str(tmp_path / "config.yaml"), "params.b=2"]
+
+    config = get_config(argv, Config)
+
+    assert config.params == {"a": 1, "b": 2}
+    assert get_config(argv, Config) is config
+
+
+def test_get_config_reloads_changed_yaml(tmp_path: Path):
+    config_path = tmp_path / "config.yaml"
+    _write_yaml(config_path, "params:\n  a: 1\n", mtime=1_000_000)
+    config = get_config([f"--config={config_path}"], Config)
+
+    _write_yaml(config_path, "params:\n  a: 2\n", mtime=2_000_000)
+    reloaded_config = get_config([f"--config={config_path}"], Config)
+
+    assert config.params.a == 1
+    assert reloaded_config.params.a == 2
+
+
+def test_get_config_relative_paths(tmp_path: Path, monkeypatch):
+    # Same relative path and modification time, but different working directories.
+    for name, value in (("d1", 5), ("d2", 6)):
+        (tmp_path / name).mkdir()
+        _write_yaml(tmp_path / name / "config.yaml", f"params:\n  a: {value}\n", mtime=1_000_000)
+
+    monkeypatch.chdir(tmp_path / "d1")
+    assert get_config(["--config", "config.yaml"], Config).params.a == 5
+    monkeypatch.chdir(tmp_path / "d2")
+    assert get_config(["--config", "config.yaml"], Config).params.a == 6
+
+
+def test_get_config_keeps_interpolations_lazy(tmp_path: Path, monkeypatch):
+    config_path = tmp_path / "config.yaml"
+    _write_yaml(
+        config_path,
+        "params:\n"
+        "  env: ${oc.env:MATTERGEN_TEST_VALUE}\n"
+        "  doubled: ${eval:'${params.missing} * 2'}\n",
+    )
+    argv = ["--config", str(config_path)]
+
+    monkeypatch.setenv("MATTERGEN_TEST_VALUE", "foo")
+    # Neither the eval resolver nor params.missing need to exist yet.
+    config = get_config(argv, Config)
+    assert config.params.env == "foo"
+
+    monkeypatch.setenv("MATTERGEN_TEST_VALUE", "bar")
+    assert get_config(argv, Config).params.env == "bar"
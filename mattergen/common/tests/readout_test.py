@@ -0,0 +1,275 @@
+import copy
+from functools import partial
+
+import pytest
+import torch
+from torch_scatter import scatter
+
+from mattergen.common.utils.readout import (
+    CombinedGraphReadout,
+    GraphReadout,
+    MultiHeadWeightedGraphReadout,
+    UnweightedGraphReadout,
+)
+
+NODE_DIM = 16
+OUT_DIM = 12
+NUM_HEADS = 4
+HEAD_DIM = 8
+
+# Constructors of the weighted readouts, left open for options such as assume_sorted_index:
+WEIGHTED_READOUT_CLASSES = [
+    partial(CombinedGraphReadout, NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM),
+    partial(MultiHeadWeightedGraphReadout, NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_mean"),
+    partial(MultiHeadWeightedGraphReadout, NODE_DIM, 3, NUM_HEADS, HEAD_DIM, "weighted_mean"),
+]
+
+
+def _all_readouts() -> list[GraphReadout]:
+    return [
+        CombinedGraphReadout(NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM),
+        MultiHeadWeightedGraphReadout(NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_sum"),
+        MultiHeadWeightedGraphReadout(NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_mean"),
+        # out_dim < head_dim projects values before pooling.
+        MultiHeadWeightedGraphReadout(NODE_DIM, 3, NUM_HEADS, HEAD_DIM, "weighted_mean"),
+    ] + [
+        UnweightedGraphReadout(NODE_DIM, OUT_DIM, pooling_type)
+        for pooling_type in ("min", "max", "sum", "mean")
+    ]
+
+
+@pytest.mark.parametrize("readout", _all_readouts())
+@pytest.mark.parametrize("num_graphs", [1, 3])
+def test_readout_without_nodes(readout: GraphReadout, num_graphs: int):
+    node_embeddings = torch.zeros(0, NODE_DIM)
+    node_to_graph_id = torch.zeros(0, dtype=torch.long)
+
+    graph_repr = readout(node_embeddings, node_to_graph_id, num_graphs)
+
+    assert torch.equal(graph_repr, torch.zeros(num_graphs, readout._out_dim))
+
+
+@pytest.mark.parametrize(
+    "readout",
+    [
+        CombinedGraphReadout(NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM),
+        MultiHeadWeightedGraphReadout(NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_sum"),
+        MultiHeadWeightedGraphReadout(NODE_DIM, 3, NUM_HEADS, HEAD_DIM, "weighted_mean"),
+    ],
+)
+@pytest.mark.parametrize("autocast", [False, True])
+def test_readout_scratch_across_grad_modes(readout: GraphReadout, autocast: bool):
+    torch.manual_seed(0)
+    node_embeddings = torch.randn(10, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (10,))
+    # Under autocast, per-node values and weights can differ in dtype:
+    with torch.autocast("cpu", dtype=torch.bfloat16, enabled=autocast):
+        expected = readout(node_embeddings, node_to_graph_id, 3).detach()
+
+        # The scratch buffer is reused without gradients, and must survive leaving inference
+        # mode:
+        for grad_mode in (torch.inference_mode, torch.no_grad, torch.inference_mode):
+            with grad_mode():
+                graph_repr = readout(node_embeddings, node_to_graph_id, 3)
+            assert graph_repr.dtype == expected.dtype
+            # Projections written into the scratch buffer aren't autocast to bfloat16:
+            assert torch.allclose(graph_repr, expected, atol=1e-2 if autocast else 1e-6)
+
+
+def _legacy_state_dict(num_mlp_layers: int) -> dict[str, torch.Tensor]:
+    # Separate scoring and transformation MLPs, as stored by older checkpoints:
+    state_dict = {}
+    for name, out_dim in (
+        ("_scoring_module", NUM_HEADS),
+        ("_transformation_mlp", NUM_HEADS * HEAD_DIM),
+    ):
+        layer_dims = [NODE_DIM] + [NUM_HEADS * HEAD_DIM] * num_mlp_layers + [out_dim]
+        for i, (in_dim, layer_out_dim) in enumerate(zip(layer_dims[:-1], layer_dims[1:])):
+            state_dict[f"{name}._layers.{2 * i}.weight"] = torch.randn(layer_out_dim, in_dim)
+            state_dict[f"{name}._layers.{2 * i}.bias"] = torch.randn(layer_out_dim)
+    state_dict["_combination_layer.weight"] = torch.randn(OUT_DIM, NUM_HEADS * HEAD_DIM)
+    return state_dict
+
+
+def test_load_legacy_state_dict_without_hidden_layers():
+    torch.manual_seed(0)
+    state_dict = _legacy_state_dict(num_mlp_layers=0)
+    readout = MultiHeadWeightedGraphReadout(
+        NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_sum", num_mlp_layers=0
+    )
+    readout.load_state_dict(state_dict)
+
+    node_embeddings = torch.randn(20, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (20,))
+    scores = torch.nn.functional.linear(
+        node_embeddings,
+        state_dict["_scoring_module._layers.0.weight"],
+        state_dict["_scoring_module._layers.0.bias"],
+    )
+    values = torch.nn.functional.linear(
+        node_embeddings,
+        state_dict["_transformation_mlp._layers.0.weight"],
+        state_dict["_transformation_mlp._layers.0.bias"],
+    )
+    weighted_values = torch.sigmoid(scores).repeat_interleave(HEAD_DIM, dim=1) * values
+    expected = scatter(weighted_values, node_to_graph_id, dim=0, dim_size=3, reduce="sum")
+    expected = expected @ state_dict["_combination_layer.weight"].t()
+
+    graph_repr = readout(node_embeddings, node_to_graph_id, 3)
+    assert torch.allclose(graph_repr, expected, atol=1e-5)
+
+
+def test_load_legacy_state_dict_with_hidden_layers():
+    readout = MultiHeadWeightedGraphReadout(
+        NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_sum", num_mlp_layers=1
+    )
+    with pytest.raises(RuntimeError, match="Cannot load separate"):
+        readout.load_state_dict(_legacy_state_dict(num_mlp_layers=1))
+
+
+@pytest.mark.parametrize("pooling_type", ["min", "max", "sum", "mean"])
+@pytest.mark.parametrize("assume_sorted_index", [False, True])
+def test_unweighted_readout_sorted_index_matches_scatter(
+    pooling_type: str, assume_sorted_index: bool
+):
+    torch.manual_seed(0)
+    readout = UnweightedGraphReadout(
+        NODE_DIM, OUT_DIM, pooling_type, assume_sorted_index=assume_sorted_index
+    )
+    node_embeddings = torch.randn(20, NODE_DIM)
+    # Graph 2 has no nodes:
+    node_to_graph_id = torch.tensor([0] * 6 + [1] * 9 + [3] * 5)
+
+    expected = readout._combination_layer(
+        scatter(node_embeddings, node_to_graph_id, dim=0, dim_size=4, reduce=pooling_type)
+    )
+    graph_repr = readout(node_embeddings, node_to_graph_id, 4)
+    assert torch.allclose(graph_repr, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("readout_cls", WEIGHTED_READOUT_CLASSES)
+def test_weighted_readout_sorted_index_matches_unsorted(readout_cls):
+    torch.manual_seed(0)
+    readout = readout_cls()
+    sorted_readout = readout_cls(assume_sorted_index=True)
+    sorted_readout.load_state_dict(readout.state_dict())
+    node_embeddings = torch.randn(20, NODE_DIM)
+    # Graph 2 has no nodes:
+    node_to_graph_id = torch.tensor([0] * 6 + [1] * 9 + [3] * 5)
+
+    # The same graphs with their nodes shuffled take the scatter_softmax path:
+    perm = torch.randperm(20)
+    expected = readout(node_embeddings[perm], node_to_graph_id[perm], 4)
+
+    # Sorted index, with and without checking that it is sorted:
+    assert torch.allclose(readout(node_embeddings, node_to_graph_id, 4), expected, atol=1e-6)
+    graph_repr = sorted_readout(node_embeddings, node_to_graph_id, 4)
+    assert torch.allclose(graph_repr, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("pooling_type", ["min", "max", "sum", "mean"])
+def test_unweighted_readout_unsorted_index_matches_scatter(pooling_type: str):
+    torch.manual_seed(0)
+    readout = UnweightedGraphReadout(NODE_DIM, OUT_DIM, pooling_type)
+    node_embeddings = torch.randn(20, NODE_DIM)
+    # Graph 2 has no nodes:
+    node_to_graph_id = torch.tensor([0] * 6 + [1] * 9 + [3] * 5)[torch.randperm(20)]
+
+    expected = readout._combination_layer(
+        scatter(node_embeddings, node_to_graph_id, dim=0, dim_size=4, reduce=pooling_type)
+    )
+    graph_repr = readout(node_embeddings, node_to_graph_id, 4)
+    assert torch.allclose(graph_repr, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("readout", _all_readouts())
+def test_readout_single_graph(readout: GraphReadout):
+    torch.manual_seed(0)
+    node_embeddings = torch.randn(20, NODE_DIM)
+    node_to_graph_id = torch.zeros(20, dtype=torch.long)
+
+    # Compare to the general path, with the same graph followed by an empty one:
+    expected = readout(node_embeddings, node_to_graph_id, 2)[:1]
+    graph_repr = readout(node_embeddings, node_to_graph_id, 1)
+    assert torch.allclose(graph_repr, expected, atol=1e-6)
+
+
+def test_load_partial_legacy_state_dict():
+    state_dict = _legacy_state_dict(num_mlp_layers=0)
+    del state_dict["_scoring_module._layers.0.weight"]
+    del state_dict["_scoring_module._layers.0.bias"]
+    readout = MultiHeadWeightedGraphReadout(
+        NODE_DIM, OUT_DIM, NUM_HEADS, HEAD_DIM, "weighted_sum", num_mlp_layers=0
+    )
+    with pytest.raises(RuntimeError, match="Cannot load a scoring MLP without"):
+        readout.load_state_dict(state_dict)
+
+
+@pytest.mark.parametrize("readout", _all_readouts())
+def test_to_onnx_round_trip(readout: GraphReadout, tmp_path):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    torch.manual_seed(0)
+    readout.eval()
+    node_to_graph_id = torch.sort(torch.randint(0, 3, (20,))).values
+    readout.to_onnx(
+        str(tmp_path / "readout.onnx"), (torch.randn(20, NODE_DIM), node_to_graph_id, 3)
+    )
+
+    # The number of nodes is dynamic, and the index may be unsorted:
+    node_embeddings = torch.randn(31, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (31,))
+    session = onnxruntime.InferenceSession(str(tmp_path / "readout.onnx"))
+    (graph_repr,) = session.run(
+        None,
+        {
+            "node_embeddings": node_embeddings.numpy(),
+            "node_to_graph_id": node_to_graph_id.numpy(),
+        },
+    )
+    with torch.no_grad():
+        expected = readout(node_embeddings, node_to_graph_id, 3)
+    assert torch.allclose(torch.from_numpy(graph_repr), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("readout", _all_readouts())
+@pytest.mark.parametrize("grad_mode", [torch.no_grad, torch.inference_mode])
+def test_quantized_readout_close_to_float(readout: GraphReadout, grad_mode):
+    torch.manual_seed(0)
+    readout.eval()
+    quantized_readout = copy.deepcopy(readout).quantize_()
+    node_embeddings = torch.randn(20, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (20,))
+
+    with grad_mode():
+        expected = readout(node_embeddings, node_to_graph_id, 3)
+        graph_repr = quantized_readout(node_embeddings, node_to_graph_id, 3)
+    assert torch.allclose(graph_repr, expected, atol=5e-2)
+
+
+@pytest.mark.parametrize("readout_cls", WEIGHTED_READOUT_CLASSES)
+def test_bf16_mlp_close_to_float(readout_cls):
+    torch.manual_seed(0)
+    readout = readout_cls()
+    bf16_readout = readout_cls(bf16_mlp=True)
+    bf16_readout.load_state_dict(readout.state_dict())
+    node_embeddings = torch.randn(20, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (20,))
+
+    expected = readout(node_embeddings, node_to_graph_id, 3)
+    graph_repr = bf16_readout(node_embeddings, node_to_graph_id, 3)
+    assert graph_repr.dtype == node_embeddings.dtype
+    assert torch.allclose(graph_repr, expected, atol=1e-2)
+
+
+@pytest.mark.parametrize("weighting_type", ["weighted_sum", "weighted_mean"])
+def test_project_before_pooling_matches_pooling_first(weighting_type: str):
+    torch.manual_seed(0)
+    readout = MultiHeadWeightedGraphReadout(NODE_DIM, 3, NUM_HEADS, HEAD_DIM, weighting_type)
+    assert readout._project_before_pooling
+    node_embeddings = torch.randn(20, NODE_DIM)
+    node_to_graph_id = torch.randint(0, 3, (20,))
+
+    graph_repr = readout(node_embeddings, node_to_graph_id, 3)
+    readout._project_before_pooling = False
+    expected = readout(node_embeddings, node_to_graph_id, 3)
+    assert torch.allclose(graph_repr, expected, atol=1e-6)
@@ -1,11 +1,45 @@
 import argparse
+import os
 import sys
-from typing import Callable, TypeVar, cast
+from functools import lru_cache
+from typing import Any, Callable, TypeVar, cast
 
-from omegaconf import OmegaConf
+from omegaconf import DictConfig, ListConfig, OmegaConf
 
 R = TypeVar("R")
 
+# Loaded yaml configs, keyed by (absolute path, modification time).
+_YAML_CACHE: dict[tuple[str, float], DictConfig | ListConfig] = {}
+
+# Merged read-only configs, keyed by (argv, config class, (absolute path, modification time) of
+# each yaml config).
+_CONFIG_CACHE: dict[tuple[tuple[str, ...], Any, tuple[tuple[str, float], ...]], DictConfig] = {}
+
+
+@lru_cache
+def _structured_schema(config_cls: Any) -> DictConfig:
+    # OmegaConf.merge copies its first argument, so the cached schema is never modified.
+    return OmegaConf.structured(config_cls)
+
+
+def _load_yaml(path: str) -> DictConfig | ListConfig:
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+    if key not in _YAML_CACHE:
+        _YAML_CACHE[key] = OmegaConf.load(path)
+    return _YAML_CACHE[key]
+
+
+def _config_paths(argv: list[str]) -> list[str]:
+    # Same paths as collected by the --config argument in get_config, without running argparse
+    paths = []
+    for i, arg in enumerate(argv):
+        if arg == "--config" and i + 1 < len(argv):
+            paths.append(argv[i + 1])
+        elif arg.startswith("--config="):
+            paths.append(arg.removeprefix("--config="))
+    return paths
+
 
 def get_config(argv: list[str] | None, config_cls: Callable[..., R]) -> R:
     """
@@ -22,10 +56,20 @@ def get_config(argv: list[str] | None, config_cls: Callable[..., R]) -> R:
         Config object, which will pass as an instance of `config_cls` among other things.
             Note: the type for this could be specified more carefully, but OmegaConf's typing
             system is a bit complex. See OmegaConf's docs for "structured" for more info.
+            The config is read-only, and the same object is returned for repeated calls with
+            the same arguments, as long as the yaml config files are unchanged.
     """
 
     if argv is None:
         argv = sys.argv[1:]
+    cache_key = (
+        tuple(argv),
+        config_cls,
+        tuple((os.path.abspath(path), os.path.getmtime(path)) for path in _config_paths(argv)),
+    )
+    if cache_key in _CONFIG_CACHE:
+        return cast(R, _CONFIG_CACHE[cache_key])
+
     # Parse command line arguments
     parser = argparse.ArgumentParser(allow_abbrev=False)  # prevent prefix matching issues
     parser.add_argument(
@@ -39,12 +83,14 @@ def get_config(argv: list[str] | None, config_cls: Callable[..., R]) -> R:
     args, config_changes = parser.parse_known_args(argv)
 
     # Read configs from file and command line
-    conf_yamls = [OmegaConf.load(c) for c in args.config]
+    conf_yamls = [_load_yaml(c) for c in args.config]
     conf_cli = OmegaConf.from_cli(config_changes)
 
     # Make merged config options
     # CLI options take priority over YAML file options
-    schema = OmegaConf.structured(config_cls)
+    schema = _structured_schema(config_cls)
+    # Not OmegaConf.unsafe_merge: it would modify the cached schema and yaml configs
     config = OmegaConf.merge(schema, *conf_yamls, conf_cli)
     OmegaConf.set_readonly(config, True)  # should not be written to
+    _CONFIG_CACHE[cache_key] = config
     return cast(R, config)
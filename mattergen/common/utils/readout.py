@@ -1,11 +1,13 @@
 # FROM: https://github.com/microsoft/FS-Mol/blob/main/fs_mol/modules/graph_readout.py
 
+import copy
+import os
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional, Tuple
 
 import torch
 import torch.nn as nn
-from torch_scatter import scatter, scatter_softmax
+from torch_scatter import gather_csr, scatter, scatter_softmax, segment_csr
 from typing_extensions import Literal
 
 
@@ -19,7 +21,9 @@ class MLP(nn.Module):
         cur_hidden_dim = input_dim
         for hidden_layer_dim in hidden_layer_dims:
             layers.append(nn.Linear(cur_hidden_dim, hidden_layer_dim))
-            layers.append(activation)
+            # The default activation is a single nn.ReLU instance shared by all MLPs, so copy it
+            # to give each layer its own module instead of aliasing it across layers and MLPs:
+            layers.append(copy.deepcopy(activation))
             cur_hidden_dim = hidden_layer_dim
         layers.append(nn.Linear(cur_hidden_dim, out_dim))
         self._layers = nn.Sequential(*layers)
@@ -28,6 +32,196 @@ class MLP(nn.Module):
         return self._layers(inputs)
 
 
+def _compile_readout_enabled() -> bool:
+    # Compiling is opt-in, as it adds a warm-up cost that only pays off for long runs.
+    return os.environ.get("MATTERGEN_COMPILE_READOUT", "0") == "1"
+
+
+def _is_sorted(index: torch.Tensor) -> bool:
+    return bool((index[1:] >= index[:-1]).all())
+
+
+def _use_segment_ops(index: torch.Tensor, assume_sorted_index: bool) -> bool:
+    # torch_scatter's segment ops are custom ops that can't be exported to ONNX.
+    if torch.onnx.is_in_onnx_export():
+        return False
+    return assume_sorted_index or _is_sorted(index)
+
+
+def _index_to_ptr(index: torch.Tensor, num_graphs: int) -> torch.Tensor:
+    """
+    Converts a sorted node_to_graph_id tensor of shape [num_nodes] to the CSR pointer tensor of
+    shape [num_graphs + 1] expected by torch_scatter's segment_* ops.
+    """
+    # searchsorted rather than bincount + cumsum, as bincount synchronises with the device.
+    graph_ids = torch.arange(num_graphs + 1, device=index.device, dtype=index.dtype)
+    return torch.searchsorted(index, graph_ids)
+
+
+def _run_mlp(mlp: nn.Module, inputs: torch.Tensor, bf16: bool) -> torch.Tensor:
+    """
+    Runs `mlp`, optionally under bfloat16 autocast to halve the memory traffic of its matmuls.
+    The result is cast back to the dtype of `inputs`, so that pooling is done in full precision.
+    """
+    with torch.autocast(device_type=inputs.device.type, dtype=torch.bfloat16, enabled=bf16):
+        outputs = mlp(inputs)
+    return outputs.to(inputs.dtype)
+
+
+def _fit_scratch(
+    scratch: torch.Tensor, numel: int, dtype: torch.dtype, device: torch.device
+) -> torch.Tensor:
+    """
+    Returns `scratch` if it can hold `numel` elements of the given dtype on the given device,
+    and a new buffer otherwise. Buffers allocated under torch.inference_mode can't be written to
+    outside of it, so the buffer is also replaced when inference mode is entered or left.
+    """
+    if (
+        scratch.numel() < numel
+        or scratch.device != device
+        or scratch.dtype != dtype
+        or scratch.is_inference() != torch.is_inference_mode_enabled()
+    ):
+        return torch.empty(numel, dtype=dtype, device=device)
+    return scratch
+
+
+# Names of the torch_scatter reductions in torch.Tensor.scatter_reduce_. Mean pooling doesn't
+# use scatter_reduce_, see _scatter_reduce.
+_NATIVE_REDUCE = {"min": "amin", "max": "amax", "sum": "sum"}
+
+
+# Reductions over all nodes, used when the batch consists of a single graph.
+_DENSE_REDUCE = {"min": torch.amin, "max": torch.amax, "sum": torch.sum, "mean": torch.mean}
+
+
+def _scatter_reduce(
+    src: torch.Tensor, index: torch.Tensor, num_graphs: int, reduce: str
+) -> torch.Tensor:
+    """
+    Native equivalent of torch_scatter's scatter(src, index, dim=0, dim_size=num_graphs,
+    reduce=reduce) for 2D `src`. Graphs without nodes are 0, as in torch_scatter.
+    """
+    out = src.new_zeros((num_graphs, src.size(1)))
+    if not torch.onnx.is_in_onnx_export():
+        if reduce == "mean":
+            # Sum in a single pass, and count nodes per graph with a bincount rather than
+            # a second scatter:
+            count = torch.bincount(index, minlength=num_graphs).clamp_min_(1).unsqueeze(1)
+            return out.index_add_(0, index, src) / count
+        return out.scatter_reduce_(
+            0,
+            index.unsqueeze(1).expand_as(src),
+            src,
+            reduce=_NATIVE_REDUCE[reduce],
+            include_self=False,
+        )
+
+    index = index.unsqueeze(1).expand_as(src)
+
+    # ONNX does not support include_self=False, so start from the identity of the reduction:
+    if reduce == "sum":
+        return out.scatter_add_(0, index, src)
+    if reduce == "mean":
+        count = out.scatter_add(0, index, torch.ones_like(src))
+        return out.scatter_add_(0, index, src) / count.clamp_min(1)
+    identity = float("inf") if reduce == "min" else float("-inf")
+    out = out.fill_(identity).scatter_reduce_(0, index, src, reduce=_NATIVE_REDUCE[reduce])
+    return out.masked_fill(out == identity, 0.0)  # graphs without nodes
+
+
+def _scatter_softmax(src: torch.Tensor, index: torch.Tensor, num_graphs: int) -> torch.Tensor:
+    """
+    Softmax over the nodes of each graph. Uses torch_scatter's scatter_softmax, except during
+    ONNX export, where its custom max op is replaced by native scatter ops.
+    """
+    if not torch.onnx.is_in_onnx_export():
+        return scatter_softmax(src, index=index, dim=0)
+    src_max = _scatter_reduce(src, index, num_graphs, "max").index_select(0, index)
+    exp = torch.exp(src - src_max)
+    return exp / _scatter_reduce(exp, index, num_graphs, "sum").index_select(0, index)
+
+
+def _segment_softmax(src: torch.Tensor, ptr: torch.Tensor) -> torch.Tensor:
+    """
+    Softmax over the segments of `src` given by the CSR pointer tensor `ptr`. Equivalent to
+    scatter_softmax for sorted indices, but with fewer passes over `src`.
+    """
+    src_max = gather_csr(segment_csr(src, ptr, reduce="max"), ptr)
+    exp = torch.exp(src - src_max)
+    return exp / gather_csr(segment_csr(exp, ptr, reduce="sum"), ptr)
+
+
+@torch.jit.script
+def _sum_per_graph(
+    values: torch.Tensor,
+    node_to_graph_id: torch.Tensor,
+    num_graphs: int,
+    out: Optional[torch.Tensor] = None,
+    exporting: bool = False,
+) -> torch.Tensor:
+    """
+    Sums up per-node values per graph.
+
+    Args:
+        values: float tensor of shape [num_nodes, dim].
+        node_to_graph_id: int tensor of shape [num_nodes], assigning a graph_id to each node.
+        num_graphs: number of graphs in the batch.
+        out: optional zeroed float tensor of shape [num_graphs, dim] to sum into. Ignored if
+            num_graphs is 1.
+        exporting: whether the caller is being exported to ONNX, in which case torch_scatter's
+            custom op is replaced by a native scatter. Passed in, as it can't be queried from
+            TorchScript.
+
+    Returns:
+        float tensor of shape [num_graphs, dim]
+    """
+    if num_graphs == 1:
+        return values.sum(dim=0, keepdim=True)
+    if exporting:
+        if out is None:
+            out = values.new_zeros((num_graphs, values.size(1)))
+        return out.scatter_add_(0, node_to_graph_id.unsqueeze(1).expand_as(values), values)
+    return scatter(values, node_to_graph_id, dim=0, out=out, dim_size=num_graphs, reduce="sum")
+
+
+@torch.jit.script
+def _apply_weights(
+    weights: torch.Tensor,
+    values: torch.Tensor,
+    node_to_graph_id: torch.Tensor,
+    num_graphs: int,
+    head_dim: int,
+    out: Optional[torch.Tensor] = None,
+    exporting: bool = False,
+) -> torch.Tensor:
+    """
+    Multiplies per-head values by their weights and sums them up per graph. Values are kept
+    in a flat layout, so that the multiply is a single contiguous elementwise op.
+
+    Args:
+        weights: float tensor of shape [num_nodes, num_heads].
+        values: float tensor of shape [num_nodes, num_heads * head_dim], with the values of
+            each head stored contiguously.
+        node_to_graph_id: int tensor of shape [num_nodes], assigning a graph_id to each node.
+        num_graphs: number of graphs in the batch.
+        head_dim: size of the values of each head.
+        out: see _sum_per_graph.
+        exporting: see _sum_per_graph.
+
+    Returns:
+        float tensor of shape [num_graphs, num_heads * head_dim]
+    """
+    weighted_values = values * weights.repeat_interleave(head_dim, dim=1)
+    return _sum_per_graph(weighted_values, node_to_graph_id, num_graphs, out, exporting)
+
+
+@torch.jit.script
+def _relu_linear(inputs: torch.Tensor, weight: torch.Tensor) -> torch.Tensor:
+    # Scripted so that the ReLU is fused into the matmul instead of writing its own output.
+    return nn.functional.linear(torch.relu(inputs), weight)
+
+
 class GraphReadout(nn.Module, ABC):
     def __init__(
         self,
@@ -43,6 +237,50 @@ class GraphReadout(nn.Module, ABC):
         self._node_dim = node_dim
         self._out_dim = out_dim
 
+    def quantize_(self) -> "GraphReadout":
+        """
+        Replaces all linear layers in place by dynamically int8-quantized ones. Meant for
+        inference only (e.g., sampling), to be called once after loading the weights.
+        Quantized layers do not support training and run on CPU only.
+
+        Returns:
+            self, for chaining.
+        """
+        torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        return self
+
+    def to_onnx(
+        self,
+        path: str,
+        example_inputs: Tuple[torch.Tensor, torch.Tensor, int],
+        opset_version: int = 18,
+    ) -> None:
+        """
+        Exports the readout to ONNX, e.g., to build a TensorRT engine for inference. While
+        exporting, torch_scatter's custom ops are replaced by native scatter ops.
+
+        Args:
+            path: Path of the ONNX file to write.
+            example_inputs: (node_embeddings, node_to_graph_id, num_graphs) used for tracing.
+                The number of nodes is dynamic in the exported graph, but the number of graphs
+                is fixed to the one of the example inputs.
+            opset_version: ONNX opset to export to. Opset 18 is the first one supporting max
+                and min reductions in ScatterElements.
+        """
+        node_embeddings, node_to_graph_id, num_graphs = example_inputs
+        torch.onnx.export(
+            _FixedNumGraphsReadout(self, num_graphs),
+            (node_embeddings, node_to_graph_id),
+            path,
+            opset_version=opset_version,
+            input_names=["node_embeddings", "node_to_graph_id"],
+            output_names=["graph_representations"],
+            dynamic_axes={
+                "node_embeddings": {0: "num_nodes"},
+                "node_to_graph_id": {0: "num_nodes"},
+            },
+        )
+
     @abstractmethod
     def forward(
         self,
@@ -64,6 +302,18 @@ class GraphReadout(nn.Module, ABC):
         pass
 
 
+class _FixedNumGraphsReadout(nn.Module):
+    """Wraps a readout for export, so that num_graphs is a constant instead of a graph input."""
+
+    def __init__(self, readout: GraphReadout, num_graphs: int):
+        super().__init__()
+        self._readout = readout
+        self._num_graphs = num_graphs
+
+    def forward(self, node_embeddings: torch.Tensor, node_to_graph_id: torch.Tensor):
+        return self._readout(node_embeddings, node_to_graph_id, self._num_graphs)
+
+
 class CombinedGraphReadout(GraphReadout):
     def __init__(
         self,
@@ -71,57 +321,165 @@ class CombinedGraphReadout(GraphReadout):
         out_dim: int,
         num_heads: int,
         head_dim: int,
+        num_mlp_layers: int = 1,
+        assume_sorted_index: bool = False,
+        bf16_mlp: bool = False,
     ):
         """
         See superclass for first few parameters.
 
+        Combines a weighted mean, a weighted sum and a max pooling of the node representations.
+        The weighted mean and weighted sum share a single MLP computing per-head scores and
+        values, so that node representations are only transformed once per forward pass.
+
         Args:
             num_heads: Number of independent heads to use for independent weights.
             head_dim: Size of the result of each independent head.
             num_mlp_layers: Number of layers in the MLPs used to compute per-head weights and
                 outputs.
+            assume_sorted_index: If True, node_to_graph_id is promised to be sorted and
+                segment reductions are used without checking. Otherwise, segment reductions
+                are only used when node_to_graph_id is found to be sorted.
+                Checking costs a host-device synchronisation per forward pass on GPU.
+            bf16_mlp: If True, the MLP computing per-head weights and outputs runs under
+                bfloat16 autocast. Pooling is still done in the dtype of node_embeddings.
         """
         super().__init__(node_dim, out_dim)
         self._num_heads = num_heads
         self._head_dim = head_dim
+        self._assume_sorted_index = assume_sorted_index
+        self._bf16_mlp = bf16_mlp
 
-        # Create weighted_mean, weighted_sum, max pooling layers:
-        self._weighted_mean_pooler = MultiHeadWeightedGraphReadout(
-            node_dim=node_dim,
-            out_dim=out_dim,
-            num_heads=num_heads,
-            head_dim=head_dim,
-            weighting_type="weighted_mean",
-        )
-        self._weighted_sum_pooler = MultiHeadWeightedGraphReadout(
-            node_dim=node_dim,
-            out_dim=out_dim,
-            num_heads=num_heads,
-            head_dim=head_dim,
-            weighting_type="weighted_sum",
-        )
-        self._max_pooler = UnweightedGraphReadout(
-            node_dim=node_dim,
-            out_dim=out_dim,
-            pooling_type="max",
+        # Single MLP computing [scores, values] for the weighted_mean and weighted_sum heads:
+        self._scoring_and_transformation_mlp = MLP(
+            input_dim=self._node_dim,
+            hidden_layer_dims=[self._head_dim * num_heads] * num_mlp_layers,
+            out_dim=num_heads + num_heads * head_dim,
         )
 
+        if _compile_readout_enabled():
+            self._scoring_and_transformation_mlp.compile(dynamic=True, mode="reduce-overhead")
+
+        # Per-pooling projections to output size:
+        self._weighted_mean_projection = nn.Linear(num_heads * head_dim, out_dim, bias=False)
+        self._weighted_sum_projection = nn.Linear(num_heads * head_dim, out_dim, bias=False)
+        self._max_projection = nn.Linear(self._node_dim, out_dim, bias=False)
+
         # Single linear layer to combine results:
         self._combination_layer = nn.Linear(3 * out_dim, out_dim, bias=False)
 
+        # Reused across inference calls to hold the concatenated projections, see
+        # _raw_graph_repr_scratch:
+        self.register_buffer("_scratch", torch.empty(0), persistent=False)
+
+    def _raw_graph_repr_scratch(
+        self, num_graphs: int, like: torch.Tensor
+    ) -> Optional[torch.Tensor]:
+        """
+        Returns a [num_graphs, 3 * out_dim] view into the scratch buffer, growing it if needed,
+        so that the projections can be written into it without a concatenation. Returns None
+        when gradients are enabled (out= arguments don't support autograd), during ONNX export,
+        or if the projections have been quantized.
+        """
+        if (
+            torch.is_grad_enabled()
+            or torch.onnx.is_in_onnx_export()
+            or not isinstance(self._max_projection, nn.Linear)
+        ):
+            return None
+        numel = num_graphs * 3 * self._out_dim
+        self._scratch = _fit_scratch(self._scratch, numel, like.dtype, like.device)
+        return self._scratch[:numel].view(num_graphs, 3 * self._out_dim)
+
     def forward(
         self,
         node_embeddings: torch.Tensor,
         node_to_graph_id: torch.Tensor,
         num_graphs: int,
     ) -> torch.Tensor:
-        mean_graph_repr = self._weighted_mean_pooler(node_embeddings, node_to_graph_id, num_graphs)
-        sum_graph_repr = self._weighted_sum_pooler(node_embeddings, node_to_graph_id, num_graphs)
-        max_graph_repr = self._max_pooler(node_embeddings, node_to_graph_id, num_graphs)
-
-        # concat & non-linearity & combine:
-        raw_graph_repr = torch.cat((mean_graph_repr, sum_graph_repr, max_graph_repr), dim=1)
-
+        head_values_dim = self._num_heads * self._head_dim
+        # With a single graph, all reductions are over all nodes and need no index. Without
+        # nodes, dense max/mean are undefined, so use the scatter path, which pools to 0:
+        single_graph = num_graphs == 1 and node_embeddings.size(0) > 0
+        if not single_graph and _use_segment_ops(node_to_graph_id, self._assume_sorted_index):
+            ptr = _index_to_ptr(node_to_graph_id, num_graphs)
+        else:
+            ptr = None
+
+        # Step 1: compute scores and values once, shared by the weighted_mean and weighted_sum:
+        scores, values = _run_mlp(
+            self._scoring_and_transformation_mlp, node_embeddings, bf16=self._bf16_mlp
+        ).split(
+            [self._num_heads, head_values_dim], dim=1
+        )  # [V, num_heads], [V, num_heads * head_dim]
+        if single_graph:
+            mean_weights = torch.softmax(scores, dim=0)
+        elif ptr is not None:
+            mean_weights = _segment_softmax(scores, ptr)
+        else:
+            mean_weights = _scatter_softmax(scores, node_to_graph_id, num_graphs)
+        weights = torch.cat(
+            (
+                mean_weights,  # weighted_mean
+                torch.sigmoid(scores),  # weighted_sum
+            ),
+            dim=1,
+        )  # [V, 2 * num_heads]
+
+        # Step 2: apply weights and sum up per graph for both heads in a single pass. Both
+        # weightings share the values, so broadcast them rather than copying them per weighting:
+        weighted_values = (
+            weights.view(-1, 2, self._num_heads, 1)
+            * values.view(-1, 1, self._num_heads, self._head_dim)
+        ).view(
+            -1, 2 * head_values_dim
+        )  # [V, 2 * num_heads * head_dim]
+        per_graph_values = _sum_per_graph(
+            weighted_values,
+            node_to_graph_id,
+            num_graphs,
+            exporting=torch.onnx.is_in_onnx_export(),
+        )  # [num_graphs, 2 * num_heads * head_dim]
+        mean_graph_values, sum_graph_values = per_graph_values.split(head_values_dim, dim=1)
+
+        # Step 3: max pooling of the untransformed node representations:
+        if single_graph:
+            max_graph_values = node_embeddings.amax(dim=0, keepdim=True)  # [1, node_dim]
+        elif ptr is not None:
+            max_graph_values = segment_csr(
+                src=node_embeddings, indptr=ptr, reduce="max"
+            )  # [num_graphs, node_dim]
+        else:
+            max_graph_values = _scatter_reduce(
+                node_embeddings, node_to_graph_id, num_graphs, "max"
+            )  # [num_graphs, node_dim]
+
+        # Step 4: project each pooling to output size, concat & non-linearity & combine:
+        projections = (
+            (self._weighted_mean_projection, mean_graph_values),
+            (self._weighted_sum_projection, sum_graph_values),
+            (self._max_projection, max_graph_values),
+        )
+        raw_graph_repr = self._raw_graph_repr_scratch(num_graphs, like=node_embeddings)
+        if raw_graph_repr is None:
+            raw_graph_repr = torch.stack(
+                [projection(graph_values) for projection, graph_values in projections],
+                dim=1,
+            ).view(
+                num_graphs, 3 * self._out_dim
+            )  # [num_graphs, 3 * out_dim]
+        else:
+            # Write each projection directly into its slice of the concatenated output:
+            for i, (projection, graph_values) in enumerate(projections):
+                torch.mm(
+                    graph_values,
+                    projection.weight.t(),
+                    out=raw_graph_repr[:, i * self._out_dim : (i + 1) * self._out_dim],
+                )
+
+        if isinstance(self._combination_layer, nn.Linear):
+            return _relu_linear(raw_graph_repr, self._combination_layer.weight)
+        # Quantized combination layer, see quantize_:
         return self._combination_layer(nn.functional.relu(raw_graph_repr))
 
 
@@ -134,6 +492,8 @@ class MultiHeadWeightedGraphReadout(GraphReadout):
         head_dim: int,
         weighting_type: Literal["weighted_sum", "weighted_mean"],
         num_mlp_layers: int = 1,
+        assume_sorted_index: bool = False,
+        bf16_mlp: bool = False,
     ):
         """
         See superclass for first few parameters.
@@ -146,10 +506,18 @@ class MultiHeadWeightedGraphReadout(GraphReadout):
                 are in [0, 1] and sum up to 1 for each graph, obtained through a softmax).
             num_mlp_layers: Number of layers in the MLPs used to compute per-head weights and
                 outputs.
+            assume_sorted_index: If True, node_to_graph_id is promised to be sorted and the
+                "weighted_mean" softmax uses segment reductions without checking. Otherwise,
+                segment reductions are only used when node_to_graph_id is found to be sorted.
+                Checking costs a host-device synchronisation per forward pass on GPU.
+            bf16_mlp: If True, the MLP computing per-head weights and outputs runs under
+                bfloat16 autocast. Pooling is still done in the dtype of node_embeddings.
         """
         super().__init__(node_dim, out_dim)
         self._num_heads = num_heads
         self._head_dim = head_dim
+        self._assume_sorted_index = assume_sorted_index
+        self._bf16_mlp = bf16_mlp
 
         if weighting_type not in (
             "weighted_sum",
@@ -158,49 +526,168 @@ class MultiHeadWeightedGraphReadout(GraphReadout):
             raise ValueError(f"Unknown weighting type {weighting_type}!")
         self._weighting_type = weighting_type
 
-        self._scoring_module = MLP(
-            input_dim=self._node_dim,
-            hidden_layer_dims=[self._head_dim * num_heads] * num_mlp_layers,
-            out_dim=num_heads,
-        )
+        self._num_mlp_layers = num_mlp_layers
 
-        self._transformation_mlp = MLP(
+        # Single MLP computing [scores, values], so that node representations are read once:
+        self._scoring_and_transformation_mlp = MLP(
             input_dim=self._node_dim,
             hidden_layer_dims=[self._head_dim * num_heads] * num_mlp_layers,
-            out_dim=num_heads * head_dim,
+            out_dim=num_heads + num_heads * head_dim,
         )
         self._combination_layer = nn.Linear(num_heads * head_dim, out_dim, bias=False)
 
+        if _compile_readout_enabled():
+            # Compile the MLP in place, so that parameter names are unchanged. The number of
+            # nodes varies per batch, hence dynamic shapes:
+            self._scoring_and_transformation_mlp.compile(dynamic=True, mode="reduce-overhead")
+
+        # The combination layer is linear and pooling is a weighted sum, so the combination
+        # layer can be applied per head before pooling. This is worth it when it shrinks the
+        # per-node values that need to be scattered:
+        self._project_before_pooling = out_dim < head_dim
+
+        # Reused across inference calls to hold per-graph values, see _zeroed_scratch:
+        self.register_buffer("_scratch", torch.empty(0), persistent=False)
+
+    def _load_from_state_dict(
+        self,
+        state_dict,
+        prefix,
+        local_metadata,
+        strict,
+        missing_keys,
+        unexpected_keys,
+        error_msgs,
+    ):
+        # Older checkpoints store separate scoring and transformation MLPs. Without hidden
+        # layers, these are single linear layers that can be stacked into the fused MLP:
+        scoring_prefix = f"{prefix}_scoring_module._layers."
+        transformation_prefix = f"{prefix}_transformation_mlp._layers."
+        if any(key.startswith((scoring_prefix, transformation_prefix)) for key in state_dict):
+            legacy_keys = [
+                f"{module_prefix}0.{name}"
+                for module_prefix in (scoring_prefix, transformation_prefix)
+                for name in ("weight", "bias")
+            ]
+            if self._num_mlp_layers != 0:
+                error_msgs.append(
+                    "Cannot load separate scoring and transformation MLPs with hidden layers into "
+                    f"the fused MLP of {self.__class__.__name__}."
+                )
+            elif not all(key in state_dict for key in legacy_keys):
+                error_msgs.append(
+                    "Cannot load a scoring MLP without a transformation MLP (or vice versa) into "
+                    f"the fused MLP of {self.__class__.__name__}."
+                )
+            else:
+                for name in ("weight", "bias"):
+                    state_dict[f"{prefix}_scoring_and_transformation_mlp._layers.0.{name}"] = (
+                        torch.cat(
+                            (
+                                state_dict.pop(f"{scoring_prefix}0.{name}"),
+                                state_dict.pop(f"{transformation_prefix}0.{name}"),
+                            )
+                        )
+                    )
+        super()._load_from_state_dict(
+            state_dict,
+            prefix,
+            local_metadata,
+            strict,
+            missing_keys,
+            unexpected_keys,
+            error_msgs,
+        )
+
+    def _zeroed_scratch(
+        self, num_graphs: int, dim: int, weights: torch.Tensor, values: torch.Tensor
+    ) -> Optional[torch.Tensor]:
+        """
+        Returns a zeroed [num_graphs, dim] view into the scratch buffer, growing it if needed, so
+        that repeated inference calls (e.g., in sampling loops) don't allocate per-graph values.
+        Returns None for a single graph, or when gradients are enabled, as autograd may need the
+        contents of previous calls.
+        """
+        if num_graphs == 1 or torch.is_grad_enabled():
+            return None
+        numel = num_graphs * dim
+        # Under autocast, weights and values may differ in dtype, and their product is promoted:
+        dtype = torch.result_type(weights, values)
+        self._scratch = _fit_scratch(self._scratch, numel, dtype, values.device)
+        return self._scratch[:numel].view(num_graphs, dim).zero_()
+
+    def quantize_(self) -> GraphReadout:
+        # The weight of a quantized combination layer can't be split per head:
+        self._project_before_pooling = False
+        return super().quantize_()
+
     def forward(
         self,
         node_embeddings: torch.Tensor,
         node_to_graph_id: torch.Tensor,
         num_graphs: int,
     ) -> torch.Tensor:
-        # Step 1: compute scores, then normalise them according to config:
-        scores = self._scoring_module(node_embeddings)  # [V, num_heads]
-
+        # Step 1: compute scores and transformed node representations:
+        scores, values = _run_mlp(
+            self._scoring_and_transformation_mlp, node_embeddings, bf16=self._bf16_mlp
+        ).split(
+            [self._num_heads, self._num_heads * self._head_dim], dim=1
+        )  # [V, num_heads], [V, num_heads * head_dim]
+
+        # Step 2: normalise scores according to config:
         if self._weighting_type == "weighted_sum":
             weights = torch.sigmoid(scores)  # [V, num_heads]
         elif self._weighting_type == "weighted_mean":
-            weights = scatter_softmax(scores, index=node_to_graph_id, dim=0)  # [V, num_heads]
+            if num_graphs == 1:
+                # All nodes belong to the same graph, so no index is needed:
+                weights = torch.softmax(scores, dim=0)  # [V, num_heads]
+            elif _use_segment_ops(node_to_graph_id, self._assume_sorted_index):
+                weights = _segment_softmax(
+                    scores, _index_to_ptr(node_to_graph_id, num_graphs)
+                )  # [V, num_heads]
+            else:
+                weights = _scatter_softmax(scores, node_to_graph_id, num_graphs)  # [V, num_heads]
         else:
             raise ValueError(f"Unknown weighting type {self._weighting_type}!")
 
-        # Step 2: compute transformed node representations:
-        values = self._transformation_mlp(node_embeddings)  # [V, num_heads * head_dim]
-        values = values.view(-1, self._num_heads, self._head_dim)  # [V, num_heads, head_dim]
+        if self._project_before_pooling:
+            # Step 3: go to output size per head:
+            combination_weight = self._combination_layer.weight.view(
+                self._out_dim, self._num_heads, self._head_dim
+            )
+            projected_values = torch.einsum(
+                "vhd,ohd->vho",
+                values.view(-1, self._num_heads, self._head_dim),
+                combination_weight,
+            ).reshape(
+                -1, self._num_heads * self._out_dim
+            )  # [V, num_heads * out_dim]
+
+            # Step 4: apply weights and sum up per graph and head:
+            per_graph_values = _apply_weights(
+                weights,
+                projected_values,
+                node_to_graph_id,
+                num_graphs,
+                self._out_dim,
+                out=self._zeroed_scratch(
+                    num_graphs, self._num_heads * self._out_dim, weights, projected_values
+                ),
+                exporting=torch.onnx.is_in_onnx_export(),
+            )  # [num_graphs, num_heads * out_dim]
+            return per_graph_values.view(num_graphs, self._num_heads, self._out_dim).sum(
+                dim=1
+            )  # [num_graphs, out_dim]
 
         # Step 3: apply weights and sum up per graph:
-        weighted_values = weights.unsqueeze(-1) * values  # [V, num_heads, head_dim]
-        per_graph_values = torch.zeros(
-            (num_graphs, self._num_heads * self._head_dim),
-            device=node_embeddings.device,
-        )
-        per_graph_values.index_add_(
-            0,
+        per_graph_values = _apply_weights(
+            weights,
+            values,
             node_to_graph_id,
-            weighted_values.view(-1, self._num_heads * self._head_dim),
+            num_graphs,
+            self._head_dim,
+            out=self._zeroed_scratch(num_graphs, self._num_heads * self._head_dim, weights, values),
+            exporting=torch.onnx.is_in_onnx_export(),
         )  # [num_graphs, num_heads * head_dim]
 
         # Step 4: go to output size:
@@ -213,15 +700,21 @@ class UnweightedGraphReadout(GraphReadout):
         node_dim: int,
         out_dim: int,
         pooling_type: Literal["min", "max", "sum", "mean"],
+        assume_sorted_index: bool = False,
     ):
         """
         See superclass for first few parameters.
 
         Args:
             pooling_type: Type of pooling to use. One of "min", "max", "sum" and "mean".
+            assume_sorted_index: If True, node_to_graph_id is promised to be sorted and
+                segment reductions are used without checking. Otherwise, segment reductions
+                are only used when node_to_graph_id is found to be sorted.
+                Checking costs a host-device synchronisation per forward pass on GPU.
         """
         super().__init__(node_dim, out_dim)
         self._pooling_type = pooling_type
+        self._assume_sorted_index = assume_sorted_index
 
         if pooling_type not in ("min", "max", "sum", "mean"):
             raise ValueError(f"Unknown weighting type {self.pooling_type}!")
@@ -234,11 +727,21 @@ class UnweightedGraphReadout(GraphReadout):
         node_to_graph_id: torch.Tensor,
         num_graphs: int,
     ) -> torch.Tensor:
-        per_graph_values = scatter(
-            src=node_embeddings,
-            index=node_to_graph_id,
-            dim=0,
-            dim_size=num_graphs,
-            reduce=self._pooling_type,
-        )  # [num_graphs, self.pooling_input_dim]
+        if num_graphs == 1 and node_embeddings.size(0) > 0:
+            # All nodes belong to the same graph, so no index is needed. Without nodes, dense
+            # min/max/mean are undefined, so use the scatter path, which pools to 0:
+            per_graph_values = _DENSE_REDUCE[self._pooling_type](
+                node_embeddings, dim=0, keepdim=True
+            )  # [1, self.pooling_input_dim]
+        elif _use_segment_ops(node_to_graph_id, self._assume_sorted_index):
+            # Nodes of each graph are contiguous, so reduce segments without atomics:
+            per_graph_values = segment_csr(
+                src=node_embeddings,
+                indptr=_index_to_ptr(node_to_graph_id, num_graphs),
+                reduce=self._pooling_type,
+            )  # [num_graphs, self.pooling_input_dim]
+        else:
+            per_graph_values = _scatter_reduce(
+                node_embeddings, node_to_graph_id, num_graphs, self._pooling_type
+            )  # [num_graphs, self.pooling_input_dim]
         return self._combination_layer(per_graph_values)  # [num_graphs, out_dim]